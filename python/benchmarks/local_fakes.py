@@ -0,0 +1,420 @@
+"""
+Local stand-ins for GCP services so the helpers can be benchmarked offline
+
+ - FakeGCSHandler: the GCS JSON API upload endpoints (multipart, media and
+   resumable uploads). Point the storage client at it with the
+   STORAGE_EMULATOR_HOST environment variable. Returns the crc32c and md5
+   of the uploaded bytes so the client's checksum validation passes.
+ - FakeBigQueryHandler: canned BigQuery REST responses for query jobs. The
+   number of rows returned is taken from the LIMIT of the query, e.g.,
+   'SELECT * FROM bench.rows LIMIT 1000'. Point the bigquery client at it
+   with client_options={'api_endpoint': url}.
+ - FakePublisherClient: in-process replacement for pubsub_v1.PublisherClient
+ - FakeFirestoreClient: in-process replacement for firestore.Client
+
+The HTTP fakes run in their own process (see LocalServer) so the memory and
+CPU they use are not counted against the code being benchmarked. Uploaded
+data is counted and then discarded rather than stored.
+
+"""
+
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import base64
+import hashlib
+import itertools
+import json
+import multiprocessing
+import re
+import threading
+import time
+import uuid
+
+
+#############################################################################
+######## HTTP Servers
+
+def _serve(handler_class, conn):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    conn.send(server.server_address[1])
+    server.serve_forever()
+
+
+class LocalServer(object):
+    """ Runs a fake HTTP service in a separate process
+
+    Example use:
+        with LocalServer(FakeGCSHandler) as gcs:
+            os.environ['STORAGE_EMULATOR_HOST'] = gcs.url
+    """
+    def __init__(self, handler_class):
+        self._handler_class = handler_class
+        self._process = None
+        self.url = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def start(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self._handler_class, child_conn), daemon=True
+        )
+        self._process.start()
+        port = parent_conn.recv()
+        self.url = f'http://127.0.0.1:{port}'
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *_):
+        pass
+
+    def _query(self):
+        return {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+
+    def _read_body(self, keep=True, hashes=()) -> bytes:
+        """ Reads the request body, counting but not keeping it if keep is False
+        Each chunk is also added to the given hashes
+        """
+        remaining = int(self.headers.get('Content-Length', 0))
+        self._body_size = remaining
+        chunks = []
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            for h in hashes:
+                h.update(chunk)
+            if keep:
+                chunks.append(chunk)
+        return b''.join(chunks)
+
+    def _send(self, status, payload=None, headers=None):
+        body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_found(self):
+        self._send(404, {'error': {'code': 404, 'message': f'Not found: {self.path}'}})
+
+
+#############################################################################
+######## GCS
+
+_UPLOAD_PATH = re.compile(r'^/upload/storage/v1/b/([^/]+)/o$')
+_CONTENT_RANGE = re.compile(r'^bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)$')
+
+
+def _new_hashes():
+    """ Running crc32c and md5 of an upload, in the order _gcs_object expects """
+    # Imported here so the in-process fakes do not need the GCS dependencies
+    import google_crc32c
+    return google_crc32c.Checksum(), hashlib.md5()
+
+
+def _gcs_object(bucket, name, size, hashes):
+    crc32c, md5 = hashes
+    return {
+        'kind': 'storage#object',
+        'id': f'{bucket}/{name}/1',
+        'bucket': bucket,
+        'name': name,
+        'generation': '1',
+        'metageneration': '1',
+        'size': str(size),
+        'contentType': 'application/octet-stream',
+        'crc32c': base64.b64encode(crc32c.digest()).decode('utf-8'),
+        'md5Hash': base64.b64encode(md5.digest()).decode('utf-8'),
+    }
+
+
+class FakeGCSHandler(_JSONHandler):
+    """ GCS JSON API upload endpoints """
+    # upload_id -> [bucket, name, bytes received, (crc32c, md5) of the bytes received]
+    uploads = {}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        match = _UPLOAD_PATH.match(urlparse(self.path).path)
+        if match is None:
+            self._read_body(keep=False)
+            return self._not_found()
+        bucket = match.group(1)
+        query = self._query()
+        upload_type = query.get('uploadType')
+
+        if upload_type == 'resumable':
+            metadata = json.loads(self._read_body() or b'{}')
+            name = metadata.get('name') or query.get('name')
+            upload_id = uuid.uuid4().hex
+            with self.lock:
+                self.uploads[upload_id] = [bucket, name, 0, _new_hashes()]
+            location = (
+                f'http://{self.headers["Host"]}/upload/storage/v1/b/{bucket}/o'
+                f'?uploadType=resumable&upload_id={upload_id}'
+            )
+            return self._send(200, headers={'Location': location})
+
+        if upload_type == 'multipart':
+            body = self._read_body()
+            boundary = self.headers['Content-Type'].split('boundary=', 1)[1].strip('"')
+            parts = body.split(b'--' + boundary.encode('utf-8'))
+            metadata = json.loads(parts[1].split(b'\r\n\r\n', 1)[1])
+            # Drop the CRLF that precedes the closing boundary
+            data = parts[2].split(b'\r\n\r\n', 1)[1][:-2]
+            hashes = _new_hashes()
+            for h in hashes:
+                h.update(data)
+            return self._send(200, _gcs_object(bucket, metadata['name'], len(data), hashes))
+
+        hashes = _new_hashes()
+        self._read_body(keep=False, hashes=hashes)
+        return self._send(200, _gcs_object(bucket, query.get('name'), self._body_size, hashes))
+
+    def do_PUT(self):
+        upload_id = self._query().get('upload_id')
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+        if upload is None:
+            self._read_body(keep=False)
+            return self._not_found()
+        # Chunks arrive in order, so the bytes can be hashed as they are discarded
+        self._read_body(keep=False, hashes=upload[3])
+
+        match = _CONTENT_RANGE.match(self.headers.get('Content-Range', ''))
+        if match is None:
+            return self._send(400, {'error': {'code': 400, 'message': 'Bad Content-Range'}})
+        start, end, total = match.groups()
+        if start is not None:
+            upload[2] = int(end) + 1
+
+        if total != '*' and upload[2] >= int(total):
+            with self.lock:
+                del self.uploads[upload_id]
+            return self._send(200, _gcs_object(*upload))
+        headers = {'Range': f'bytes=0-{upload[2] - 1}'} if upload[2] else {}
+        return self._send(308, headers=headers)
+
+
+#############################################################################
+######## BigQuery
+
+_LIMIT = re.compile(r'\bLIMIT\s+(\d+)', re.IGNORECASE)
+_BQ_PAGE_SIZE = 10000
+_BQ_SCHEMA = {'fields': [
+    {'name': 'id', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+    {'name': 'name', 'type': 'STRING', 'mode': 'NULLABLE'},
+    {'name': 'value', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+]}
+
+
+class FakeBigQueryHandler(_JSONHandler):
+    """ Canned BigQuery REST responses for query jobs """
+    # job_id -> number of rows in the result
+    jobs = {}
+
+    def _job(self, project, job_id):
+        now = str(int(time.time() * 1000))
+        return {
+            'kind': 'bigquery#job',
+            'id': f'{project}:US.{job_id}',
+            'jobReference': {'projectId': project, 'jobId': job_id, 'location': 'US'},
+            'status': {'state': 'DONE'},
+            'configuration': {
+                'jobType': 'QUERY',
+                'query': {
+                    'query': '',
+                    'destinationTable': {
+                        'projectId': project, 'datasetId': '_bench', 'tableId': job_id
+                    },
+                },
+            },
+            'statistics': {
+                'creationTime': now, 'startTime': now, 'endTime': now,
+                'query': {'totalBytesProcessed': '0', 'statementType': 'SELECT'},
+            },
+        }
+
+    def _rows(self, total_rows, query):
+        """ A page of rows and the token of the next page """
+        start = int(query.get('pageToken', query.get('startIndex', 0)))
+        page_size = min(int(query.get('maxResults', _BQ_PAGE_SIZE)), _BQ_PAGE_SIZE)
+        end = min(start + page_size, total_rows)
+        rows = [
+            {'f': [{'v': str(i)}, {'v': f'name-{i}'}, {'v': str(i * 0.5)}]}
+            for i in range(start, end)
+        ]
+        return rows, (str(end) if end < total_rows else None)
+
+    def _results(self, project, job_id, query):
+        total_rows = self.jobs.get(job_id, 0)
+        response = {
+            'kind': 'bigquery#getQueryResultsResponse',
+            'jobComplete': True,
+            'jobReference': {'projectId': project, 'jobId': job_id, 'location': 'US'},
+            'schema': _BQ_SCHEMA,
+            'totalRows': str(total_rows),
+        }
+        rows, page_token = self._rows(total_rows, query)
+        if rows:
+            response['rows'] = rows
+        if page_token:
+            response['pageToken'] = page_token
+        return response
+
+    def do_POST(self):
+        parts = urlparse(self.path).path.split('/')
+        body = json.loads(self._read_body() or b'{}')
+        # /bigquery/v2/projects/{project}/jobs or /queries
+        if len(parts) != 6:
+            return self._not_found()
+        project = parts[4]
+        job_id = body.get('jobReference', {}).get('jobId') or uuid.uuid4().hex
+        sql = body.get('configuration', {}).get('query', {}).get('query') or body.get('query', '')
+        match = _LIMIT.search(sql)
+        self.jobs[job_id] = int(match.group(1)) if match else 0
+
+        if parts[5] == 'jobs':
+            return self._send(200, self._job(project, job_id))
+        if parts[5] == 'queries':
+            return self._send(200, self._results(project, job_id, {}))
+        return self._not_found()
+
+    def do_GET(self):
+        parts = urlparse(self.path).path.split('/')
+        query = self._query()
+        if len(parts) < 7:
+            return self._not_found()
+        project = parts[4]
+        # /bigquery/v2/projects/{project}/jobs/{job_id}
+        if parts[5] == 'jobs':
+            return self._send(200, self._job(project, parts[6]))
+        # /bigquery/v2/projects/{project}/queries/{job_id}
+        if parts[5] == 'queries':
+            return self._send(200, self._results(project, parts[6], query))
+        # /bigquery/v2/projects/{project}/datasets/{dataset}/tables/{job_id}[/data]
+        if parts[5] == 'datasets' and len(parts) >= 9:
+            job_id = parts[8]
+            total_rows = self.jobs.get(job_id, 0)
+            if len(parts) == 10 and parts[9] == 'data':
+                rows, page_token = self._rows(total_rows, query)
+                response = {'kind': 'bigquery#tableDataList', 'totalRows': str(total_rows), 'rows': rows}
+                if page_token:
+                    response['pageToken'] = page_token
+                return self._send(200, response)
+            return self._send(200, {
+                'kind': 'bigquery#table',
+                'tableReference': {'projectId': project, 'datasetId': parts[6], 'tableId': job_id},
+                'schema': _BQ_SCHEMA,
+                'numRows': str(total_rows),
+                'type': 'TABLE',
+            })
+        return self._not_found()
+
+
+#############################################################################
+######## Pub/Sub
+
+class FakePublisherClient(object):
+    """ In-process stand-in for pubsub_v1.PublisherClient
+    Counts are kept on the class, as the helpers create a new client per call
+    """
+    _ids = itertools.count(1)
+    published_messages = 0
+    published_bytes = 0
+
+    def __init__(self, *_, **__):
+        pass
+
+    def topic_path(self, project_id, topic_name):
+        return f'projects/{project_id}/topics/{topic_name}'
+
+    def publish(self, topic, data, **attrs):
+        if not isinstance(data, bytes):
+            raise TypeError('Data being published to Pub/Sub must be sent as a bytestring.')
+        FakePublisherClient.published_messages += 1
+        FakePublisherClient.published_bytes += len(data)
+        future = futures.Future()
+        future.set_result(str(next(self._ids)))
+        return future
+
+
+#############################################################################
+######## Firestore
+
+class FakeFirestoreClient(object):
+    """ In-process stand-in for firestore.Client
+    All clients share the same store, so documents written by a benchmark setup
+    are seen by the helper under test.
+    """
+    store = {}
+
+    def __init__(self, *_, **__):
+        pass
+
+    def collection(self, collection_name):
+        return _FakeCollection(self.store.setdefault(collection_name, {}))
+
+    @classmethod
+    def populate(cls, collection_name, n_docs):
+        cls.store[collection_name] = {
+            f'doc-{i}': {'id': i, 'name': f'name-{i}'} for i in range(n_docs)
+        }
+
+
+class _FakeCollection(object):
+    def __init__(self, docs, limit=None):
+        self._docs = docs
+        self._limit = limit
+
+    def document(self, document_id):
+        return _FakeDocumentReference(self._docs, document_id)
+
+    def limit(self, count):
+        return _FakeCollection(self._docs, count)
+
+    def stream(self):
+        doc_ids = list(itertools.islice(self._docs, self._limit))
+        for doc_id in doc_ids:
+            yield _FakeDocumentSnapshot(self._docs, doc_id)
+
+
+class _FakeDocumentReference(object):
+    def __init__(self, docs, document_id):
+        self._docs = docs
+        self.id = document_id
+
+    def set(self, values_dict):
+        self._docs[self.id] = dict(values_dict)
+
+    def delete(self):
+        self._docs.pop(self.id, None)
+
+
+class _FakeDocumentSnapshot(object):
+    def __init__(self, docs, document_id):
+        self.id = document_id
+        self.reference = _FakeDocumentReference(docs, document_id)
+        self._data = docs.get(document_id)
+
+    def to_dict(self):
+        return self._data
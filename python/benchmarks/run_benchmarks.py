@@ -0,0 +1,317 @@
+"""
+Offline benchmarks for the helpers in gcp_utility.py and gcp_streaming_to_gcs.py
+
+Runs each helper against the local stand-ins in local_fakes.py across a range
+of payload sizes, measuring latency percentiles, throughput and peak RSS.
+Each case runs in its own Python process so its peak RSS is not mixed up with
+the other cases. Results are written as JSON so runs can be compared over time.
+
+Example use, from the python folder:
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --case message_to_pubsub --repeat 50
+    python benchmarks/run_benchmarks.py --output new.json --compare results.json
+
+Requires the packages in benchmarks/requirements.txt, but no network access
+or GCP credentials. Peak RSS uses the resource module, so Linux or macOS only.
+
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import local_fakes
+
+PROJECT_ID = 'bench-project'
+BUCKET_NAME = 'bench-bucket'
+
+KB = 1024
+MB = 1024 * 1024
+
+
+#############################################################################
+######## Cases
+# Each case is given the payload size and returns (setup, run), where setup
+# (which may be None) is called untimed before every timed call of run
+
+def case_upload_to_gcs_bucket(size):
+    import gcp_utility
+    text = 'x' * size
+
+    def run():
+        if gcp_utility.upload_to_gcs_bucket(BUCKET_NAME, 'bench/upload.csv', text) is None:
+            raise RuntimeError('upload_to_gcs_bucket failed')
+    return None, run
+
+
+def case_gcs_object_stream_upload(size):
+    from google.cloud import storage
+    import gcp_streaming_to_gcs
+    client = storage.Client()
+    data = b'x' * (256 * KB)
+
+    def run():
+        with gcp_streaming_to_gcs.GCSObjectStreamUpload(
+                client=client, bucket_name=BUCKET_NAME, blob_name='bench/stream.bin') as s:
+            for _ in range(size // len(data)):
+                s.write(data)
+    return None, run
+
+
+def case_message_to_pubsub(size):
+    import gcp_utility
+    gcp_utility.pubsub_v1.PublisherClient = local_fakes.FakePublisherClient
+    message = 'x' * size
+
+    def run():
+        # message_to_pubsub swallows errors, so check the message reached the publisher
+        published = local_fakes.FakePublisherClient.published_messages
+        gcp_utility.message_to_pubsub('bench-topic', message, PROJECT_ID)
+        if local_fakes.FakePublisherClient.published_messages != published + 1:
+            raise RuntimeError('message_to_pubsub did not publish the message')
+    return None, run
+
+
+def case_read_data_from_bigquery_to_df(size):
+    from google.auth.credentials import AnonymousCredentials
+    import gcp_utility
+    gcp_utility.bigquery.Client = functools.partial(
+        gcp_utility.bigquery.Client,
+        project=PROJECT_ID,
+        credentials=AnonymousCredentials(),
+        client_options={'api_endpoint': os.environ['BENCH_BIGQUERY_URL']},
+    )
+    sql = f'SELECT id, name, value FROM bench.rows LIMIT {size}'
+
+    def run():
+        df = gcp_utility.read_data_from_bigquery_to_df(sql)
+        if df is None or len(df) != size:
+            raise RuntimeError('read_data_from_bigquery_to_df returned the wrong rows')
+    return None, run
+
+
+def case_delete_collection(size):
+    import gcp_utility
+    gcp_utility.firestore.Client = local_fakes.FakeFirestoreClient
+
+    def setup():
+        local_fakes.FakeFirestoreClient.populate('bench-collection', size)
+
+    def run():
+        gcp_utility.delete_collection('bench-collection')
+        if local_fakes.FakeFirestoreClient.store['bench-collection']:
+            raise RuntimeError('delete_collection left documents behind')
+    return setup, run
+
+
+# name -> (case, sizes, unit of size)
+CASES = {
+    'upload_to_gcs_bucket': (case_upload_to_gcs_bucket, [KB, MB, 16 * MB], 'bytes'),
+    'GCSObjectStreamUpload': (case_gcs_object_stream_upload, [MB, 16 * MB, 64 * MB], 'bytes'),
+    'message_to_pubsub': (case_message_to_pubsub, [100, 10 * KB, MB], 'bytes'),
+    'read_data_from_bigquery_to_df': (case_read_data_from_bigquery_to_df, [100, 10000, 100000], 'rows'),
+    'delete_collection': (case_delete_collection, [100, 1000, 10000], 'docs'),
+}
+
+
+#############################################################################
+######## Measurement
+
+def peak_rss_bytes():
+    """ Peak resident set size of this process so far """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak if sys.platform == 'darwin' else peak * KB
+
+
+def percentile(sorted_values, pct):
+    """ Nearest rank percentile of an already sorted list """
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100.0 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def measure(name, size, repeat, warmup):
+    """ Run a single case in this process and return its result dict """
+    case, _, unit = CASES[name]
+    setup, run = case(size)
+    rss_before = peak_rss_bytes()
+
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        run()
+
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    total_time = sum(timings)
+    result = {
+        'case': name,
+        'size': size,
+        'unit': unit,
+        'repeat': repeat,
+        'latency_s': {
+            'min': timings[0],
+            'p50': percentile(timings, 50),
+            'p90': percentile(timings, 90),
+            'p99': percentile(timings, 99),
+            'max': timings[-1],
+            'mean': total_time / len(timings),
+        },
+        'throughput_per_s': size * len(timings) / total_time if total_time else 0.0,
+        'calls_per_s': len(timings) / total_time if total_time else 0.0,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'peak_rss_before_bytes': rss_before,
+    }
+    # Growth of the peak while the helper ran, without the imports and payload
+    result['peak_rss_delta_bytes'] = result['peak_rss_bytes'] - rss_before
+    return result
+
+
+def run_case_in_subprocess(name, size, args, env):
+    """ Run a case in a fresh interpreter so peak RSS is per case """
+    fd, result_file = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        command = [
+            sys.executable, os.path.abspath(__file__),
+            '--child', name, str(size),
+            '--repeat', str(args.repeat),
+            '--warmup', str(args.warmup),
+            '--result-file', result_file,
+        ]
+        # The helpers print as they go, which is not useful here
+        completed = subprocess.run(
+            command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        if completed.returncode != 0:
+            return {'case': name, 'size': size, 'error': completed.stderr.decode('utf-8')[-2000:]}
+        with open(result_file) as f:
+            return json.load(f)
+    finally:
+        os.remove(result_file)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=BENCHMARK_DIR, stderr=subprocess.DEVNULL
+        ).decode('utf-8').strip()
+    except Exception:
+        return None
+
+
+def rss_delta(result):
+    """ Peak RSS growth of a case, also for results saved before it was recorded """
+    return result['peak_rss_bytes'] - result['peak_rss_before_bytes']
+
+
+def compare(results, baseline_file):
+    """ Print the change in p50 latency, throughput and peak RSS growth against a previous run """
+    with open(baseline_file) as f:
+        baseline = {
+            (r['case'], r['size']): r for r in json.load(f)['results'] if 'error' not in r
+        }
+    print(f"\nCompared with {baseline_file}")
+    print(f"{'case':32} {'size':>10} {'p50 change':>12} {'throughput change':>18} {'RSS delta change':>17}")
+    for r in results:
+        old = baseline.get((r['case'], r['size']))
+        if old is None or 'error' in r:
+            continue
+        p50_change = r['latency_s']['p50'] / old['latency_s']['p50'] - 1 if old['latency_s']['p50'] else 0.0
+        tp_change = r['throughput_per_s'] / old['throughput_per_s'] - 1 if old['throughput_per_s'] else 0.0
+        # Absolute rather than relative, as the growth of small cases is often 0
+        rss_change = (rss_delta(r) - rss_delta(old)) / MB
+        print(f"{r['case']:32} {r['size']:>10} {p50_change:>+12.1%} {tp_change:>+18.1%} {rss_change:>+15.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--case', action='append', choices=sorted(CASES),
+                        help='case to run, may be given more than once, defaults to all')
+    parser.add_argument('--repeat', type=int, default=20, help='timed calls per size')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed calls per size')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    parser.add_argument('--child', nargs=2, metavar=('CASE', 'SIZE'), help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = measure(args.child[0], int(args.child[1]), args.repeat, args.warmup)
+        with open(args.result_file, 'w') as f:
+            json.dump(result, f)
+        return
+
+    results = []
+    with local_fakes.LocalServer(local_fakes.FakeGCSHandler) as gcs, \
+            local_fakes.LocalServer(local_fakes.FakeBigQueryHandler) as bq:
+        env = dict(
+            os.environ,
+            STORAGE_EMULATOR_HOST=gcs.url,
+            BENCH_BIGQUERY_URL=bq.url,
+            GOOGLE_CLOUD_PROJECT=PROJECT_ID,
+        )
+        for name in args.case or CASES:
+            for size in CASES[name][1]:
+                result = run_case_in_subprocess(name, size, args, env)
+                results.append(result)
+                if 'error' in result:
+                    print(f"{name:32} {size:>10} ERROR\n{result['error']}")
+                    continue
+                latency = result['latency_s']
+                print(
+                    f"{name:32} {size:>10} {result['unit']:5} "
+                    f"p50 {latency['p50'] * 1000:9.2f}ms p99 {latency['p99'] * 1000:9.2f}ms "
+                    f"{result['throughput_per_s']:14.0f} {result['unit']}/s "
+                    f"peak RSS {result['peak_rss_bytes'] / MB:7.1f}MB "
+                    f"(+{result['peak_rss_delta_bytes'] / MB:.1f}MB during calls)"
+                )
+
+    output = {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'warmup': args.warmup,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+    # Fail so CI notices cases that could not run
+    errors = [r for r in results if 'error' in r]
+    if errors:
+        print(f"{len(errors)} of {len(results)} cases failed")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -32,6 +32,10 @@ given by datediff (supplied in the pub/sub message).
 
 The date can also be included in the destination file name, so the title can be datestamped.
 
+Copy gcp_utility.py and gcp_instrumentation.py into this folder before deploying.
+Each invocation is logged as a structured JSON line with its wall time, bytes
+downloaded and outcome, along with the helper calls it makes.
+
 """
 
 import base64
@@ -41,10 +45,14 @@ import json
 from time import strftime
 from datetime import date, timedelta
 
-# Get functions from the gcp_utility.py module 
-from gcp_utility import upload_to_bucket
-from gcp_hotspots import message_to_pubsub
+# Get functions from the gcp_utility.py and gcp_instrumentation.py modules
+from gcp_utility import upload_to_gcs_bucket, message_to_pubsub
+from gcp_instrumentation import add_sink, instrumented, record_bytes, record_error, JsonLogSink
+
+# Log each invocation, and the helper calls it makes, as structured JSON for Cloud Logging
+add_sink(JsonLogSink())
 
+@instrumented('cf_get_file_from_url')
 def pubsub_trigger(event, context):
     """Triggered from a message on a Cloud Pub/Sub topic, 
     extracts variables from message and uploads file from 
@@ -60,14 +68,15 @@ def pubsub_trigger(event, context):
     pubsub_message = base64.b64decode(event['data']).decode('utf-8')
 
     # recover the variabes from the message
-    json_msg = json.loads(pubsub_message)
     try:
+        json_msg = json.loads(pubsub_message)
         source_file_name = json_msg['source_file_name']
         bucket_name = json_msg['bucket_name']
         destination_blob_name = json_msg['destination_blob_name']
         datediff = json_msg['datediff']
     except Exception as e:
         print(e)
+        record_error(e)
         message_to_pubsub(error_topic_name, "Error getting the variables from Pub/Sub", project_id)
         return   
 
@@ -86,20 +95,23 @@ def pubsub_trigger(event, context):
 
     except Exception as e:
         print(e)
+        record_error(e)
         message_to_pubsub(error_topic_name, "Error processing date in filename: {} / {}".format(bucket_name, destination_blob_name), project_id)
         return
 
     print("Downloading...{}".format(source_file_name))
     # get data from url
     response = requests.get(source_file_name, allow_redirects=True)
+    record_bytes(len(response.content))
 
     # if successful download then upload to bucket
     if response.status_code == 200:
         # Save to bucket
         content_type = response.headers.get('content-type')
-        uri = upload_to_bucket(bucket_name, destination_blob_name, response.content, content_type=content_type)
+        uri = upload_to_gcs_bucket(bucket_name, destination_blob_name, response.content, content_type=content_type)
         if uri is None:
             print("Error uploading file to bucket: {} / {}".format(bucket_name, destination_blob_name))
+            record_error(IOError("Error uploading file to bucket: {} / {}".format(bucket_name, destination_blob_name)))
             message_to_pubsub(error_topic_name, "Error uploading file to bucket: {} / {}".format(bucket_name, destination_blob_name), project_id)
             return 
         else:
@@ -108,6 +120,7 @@ def pubsub_trigger(event, context):
     # if not 200 status then error getting file from url        
     else:
         print("Error getting file {}, code {}".format(source_file_name, response.status_code))
+        record_error(requests.HTTPError("Error getting file {}, code {}".format(source_file_name, response.status_code), response=response))
         message_to_pubsub(error_topic_name, "Error downloading file from url: {}".format(source_file_name), project_id)
 
 
@@ -0,0 +1,326 @@
+"""
+Per call instrumentation for the helpers in gcp_utility.py,
+gcp_streaming_to_gcs.py and the example Cloud Functions.
+
+Records the wall time, bytes transferred and outcome of each helper call and
+passes the record to any registered sinks. Retries are only included for
+helpers that count them with record_retry() (e.g., GCSObjectStreamUpload),
+as the client libraries retry internally without reporting it.
+
+ - JsonLogSink writes structured JSON log lines, which Cloud Logging parses
+   into jsonPayload fields when written to stdout in Cloud Functions/Cloud Run
+ - HistogramSink keeps in-process latency histograms per helper
+ - OpenTelemetrySink emits an OpenTelemetry span per call (optional,
+   requires opentelemetry-api)
+
+When no sinks are registered and no invocation is being aggregated, the
+instrumented helpers call straight through to the wrapped function.
+
+Example use in a Cloud Function:
+
+    import gcp_instrumentation
+    from gcp_utility import upload_to_gcs_bucket, message_to_pubsub
+
+    gcp_instrumentation.add_sink(gcp_instrumentation.JsonLogSink())
+
+    def pubsub_trigger(event, context):
+        with gcp_instrumentation.invocation_stats() as stats:
+            upload_to_gcs_bucket('bucket-name', 'folder/file.csv', 'a,b\\n1,2')
+            message_to_pubsub('topic-name', 'done', 'project-id')
+        print(stats.as_dict())
+
+"""
+
+import bisect
+import contextlib
+import contextvars
+import functools
+import json
+import sys
+import threading
+import time
+
+
+# Registered sinks, each with an emit(record) method
+_sinks = []
+# The record of the helper call currently running, if any
+_current_call = contextvars.ContextVar('gcp_current_call', default=None)
+# The InvocationStats currently aggregating calls, if any
+_current_invocation = contextvars.ContextVar('gcp_current_invocation', default=None)
+
+
+class CallRecord(object):
+    """ The measurements for a single helper call """
+    def __init__(self, name: str):
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.wall_time_s = 0.0
+        self.bytes = 0
+        # None until the helper counts a retry, so unmeasured retries are not reported as 0
+        self.retries = None
+        self.outcome = 'ok'
+        self.error_type = None
+        self.error_message = None
+        self._start = time.perf_counter()
+
+    def as_dict(self) -> dict:
+        entry = {
+            'helper': self.name,
+            'wall_time_s': self.wall_time_s,
+            'bytes': self.bytes,
+            'outcome': self.outcome,
+            'error_type': self.error_type,
+            'error_message': self.error_message,
+        }
+        if self.retries is not None:
+            entry['retries'] = self.retries
+        return entry
+
+
+#############################################################################
+######## Recording
+
+def add_sink(sink):
+    """ Register a sink, which must have an emit(record) method """
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+
+def clear_sinks():
+    del _sinks[:]
+
+
+def enabled() -> bool:
+    """ True if calls are currently being recorded """
+    return bool(_sinks) or _current_invocation.get() is not None
+
+
+def begin(name: str, count_retries: bool=False):
+    """ Start recording a helper call
+    Args:
+      name (str): the name of the helper
+      count_retries (bool): True if the helper counts its retries with record_retry(),
+      so the record reports 0 rather than leaving retries out
+    Returns:
+      a CallRecord, or None if instrumentation is disabled
+    """
+    if not enabled():
+        return None
+    record = CallRecord(name)
+    if count_retries:
+        record.retries = 0
+    return record
+
+
+def finish(record, error: Exception=None):
+    """ Stop recording a helper call and pass the record to the sinks
+    Args:
+      record (CallRecord): the record returned from begin(), may be None
+      error (Exception): the exception that ended the call, if any
+    """
+    if record is None:
+        return
+    record.wall_time_s = time.perf_counter() - record._start
+    if error is not None:
+        _set_error(record, error)
+
+    invocation = _current_invocation.get()
+    if invocation is not None:
+        invocation.add(record)
+    for sink in _sinks:
+        try:
+            sink.emit(record)
+        except Exception as e:
+            print(f"Error emitting instrumentation record {e}")
+
+
+def instrumented(name: str=None):
+    """ Decorator recording each call of the wrapped helper
+    Args:
+      name (str): the name to record calls under, defaults to the function name
+    """
+    def decorator(func):
+        helper_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            record = begin(helper_name)
+            if record is None:
+                return func(*args, **kwargs)
+            token = _current_call.set(record)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                _current_call.reset(token)
+                finish(record, e)
+                raise
+            _current_call.reset(token)
+            finish(record)
+            return result
+        return wrapper
+    return decorator
+
+
+def record_bytes(n: int, record=None):
+    """ Add to the bytes transferred by the current helper call """
+    record = record or _current_call.get()
+    if record is not None:
+        record.bytes += n
+
+
+def record_retry(record=None):
+    """ Count a retry in the current helper call """
+    record = record or _current_call.get()
+    if record is not None:
+        record.retries = (record.retries or 0) + 1
+
+
+def record_error(error: Exception, record=None):
+    """ Mark the current helper call as failed
+    Used by helpers that catch the exception and return None
+    """
+    record = record or _current_call.get()
+    if record is not None:
+        _set_error(record, error)
+
+
+def _set_error(record, error):
+    record.outcome = 'error'
+    record.error_type = type(error).__name__
+    record.error_message = str(error)
+
+
+#############################################################################
+######## Invocation Stats
+
+class InvocationStats(object):
+    """ Aggregated stats of all helper calls within one invocation """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._helpers = {}
+        self._start = time.perf_counter()
+        self.wall_time_s = 0.0
+
+    def add(self, record):
+        with self._lock:
+            stats = self._helpers.setdefault(record.name, {
+                'calls': 0,
+                'errors': 0,
+                'total_time_s': 0.0,
+                'max_time_s': 0.0,
+                'bytes': 0,
+            })
+            stats['calls'] += 1
+            if record.outcome != 'ok':
+                stats['errors'] += 1
+            stats['total_time_s'] += record.wall_time_s
+            stats['max_time_s'] = max(stats['max_time_s'], record.wall_time_s)
+            stats['bytes'] += record.bytes
+            if record.retries is not None:
+                stats['retries'] = stats.get('retries', 0) + record.retries
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                'wall_time_s': self.wall_time_s,
+                'helpers': {name: dict(stats) for name, stats in self._helpers.items()},
+            }
+
+
+@contextlib.contextmanager
+def invocation_stats():
+    """ Aggregate the stats of all helper calls made within the block,
+    e.g., for one Cloud Function invocation
+    """
+    stats = InvocationStats()
+    token = _current_invocation.set(stats)
+    try:
+        yield stats
+    finally:
+        stats.wall_time_s = time.perf_counter() - stats._start
+        _current_invocation.reset(token)
+
+
+#############################################################################
+######## Sinks
+
+class JsonLogSink(object):
+    """ Writes each call as a structured JSON log line
+    See https://cloud.google.com/logging/docs/structured-logging
+    """
+    def __init__(self, stream=None):
+        self._stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        entry = record.as_dict()
+        entry['severity'] = 'INFO' if record.outcome == 'ok' else 'ERROR'
+        entry['message'] = f"{record.name} {record.outcome} in {record.wall_time_s:.3f}s"
+        line = json.dumps(entry)
+        with self._lock:
+            print(line, file=self._stream, flush=True)
+
+
+class HistogramSink(object):
+    """ Keeps a latency histogram, bytes and error counts per helper """
+    # Bucket upper bounds in seconds, the last bucket counts everything above
+    DEFAULT_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self._bounds = tuple(bounds)
+        self._lock = threading.Lock()
+        self._helpers = {}
+
+    def emit(self, record):
+        with self._lock:
+            hist = self._helpers.setdefault(record.name, {
+                'counts': [0] * (len(self._bounds) + 1),
+                'calls': 0,
+                'errors': 0,
+                'total_time_s': 0.0,
+                'bytes': 0,
+            })
+            hist['counts'][bisect.bisect_left(self._bounds, record.wall_time_s)] += 1
+            hist['calls'] += 1
+            if record.outcome != 'ok':
+                hist['errors'] += 1
+            hist['total_time_s'] += record.wall_time_s
+            hist['bytes'] += record.bytes
+            if record.retries is not None:
+                hist['retries'] = hist.get('retries', 0) + record.retries
+
+    def snapshot(self) -> dict:
+        """ Returns a copy of the histograms, keyed by helper name """
+        with self._lock:
+            return {
+                name: dict(hist, counts=list(hist['counts']), bounds=list(self._bounds))
+                for name, hist in self._helpers.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._helpers = {}
+
+
+class OpenTelemetrySink(object):
+    """ Emits an OpenTelemetry span for each call
+    Requires opentelemetry-api, with a tracer provider configured by the caller
+    """
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = tracer or trace.get_tracer(__name__)
+
+    def emit(self, record):
+        span = self._tracer.start_span(record.name, start_time=record.start_ns)
+        span.set_attribute('gcp.helper.bytes', record.bytes)
+        if record.retries is not None:
+            span.set_attribute('gcp.helper.retries', record.retries)
+        span.set_attribute('gcp.helper.outcome', record.outcome)
+        if record.error_type is not None:
+            span.set_attribute('gcp.helper.error_type', record.error_type)
+            span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, record.error_message))
+        span.end(end_time=record.start_ns + int(record.wall_time_s * 1e9))
@@ -0,0 +1,153 @@
+"""
+In-process stand-in for the Pub/Sub subscriber service, so code using
+gcp_pubsub_subscriber.py can be tested without the emulator or a project.
+
+Example use:
+
+    import gcp_pubsub_fakes
+    import gcp_pubsub_subscriber
+
+    client = gcp_pubsub_fakes.FakeSubscriberClient()
+    client.add_message(b'{"key1": "value1"}')
+
+    with gcp_pubsub_subscriber.PubSubStreamSubscriber(
+            project_id='project-id',
+            subscription_name='subscription-name',
+            handler=print,
+            client=client) as s:
+        s.wait(timeout=1)
+
+    print(client.acked, client.nacked)
+
+"""
+
+from concurrent import futures
+import itertools
+import queue
+import threading
+
+
+class FakeSubscriberClient(object):
+    """ In-process stand-in for pubsub_v1.SubscriberClient
+
+    Messages added with add_message() are handed to the callback through the
+    given scheduler, keeping within the max_messages and max_bytes of the
+    flow control, and the ids of acked and nacked messages are recorded.
+    """
+    def __init__(self, *_, **__):
+        self._messages = queue.Queue()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.acked = []
+        self.nacked = []
+        # The flow control given to the last subscribe() call
+        self.flow_control = None
+
+    def subscription_path(self, project_id, subscription_name):
+        return f'projects/{project_id}/subscriptions/{subscription_name}'
+
+    def add_message(self, data: bytes):
+        message_id = str(next(self._ids))
+        self._messages.put((message_id, data))
+        return message_id
+
+    def subscribe(self, subscription, callback, flow_control=None, scheduler=None,
+                  await_callbacks_on_shutdown=False):
+        self.flow_control = flow_control
+        return _FakeStreamingPullFuture(
+            self,
+            callback,
+            scheduler,
+            getattr(flow_control, 'max_messages', 1000),
+            getattr(flow_control, 'max_bytes', 100 * 1024 * 1024),
+            await_callbacks_on_shutdown,
+        )
+
+    def _settle(self, message_id, acked):
+        with self._lock:
+            (self.acked if acked else self.nacked).append(message_id)
+
+
+class _FakeStreamingPullFuture(futures.Future):
+    """ Dispatches messages until cancelled, then shuts the scheduler down """
+    def __init__(self, client, callback, scheduler, max_messages, max_bytes, await_callbacks):
+        super().__init__()
+        self._client = client
+        self._callback = callback
+        self._scheduler = scheduler
+        self._max_messages = max_messages
+        self._max_bytes = max_bytes
+        self._await_callbacks = await_callbacks
+
+        self._capacity = threading.Condition()
+        self._outstanding_messages = 0
+        self._outstanding_bytes = 0
+        self._stopping = threading.Event()
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def _has_room(self, size):
+        # Like the client library, a message larger than max_bytes is let
+        # through once nothing else is outstanding
+        if self._outstanding_messages >= self._max_messages:
+            return False
+        return self._outstanding_messages == 0 or self._outstanding_bytes + size <= self._max_bytes
+
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            try:
+                message_id, data = self._client._messages.get(timeout=0.01)
+            except queue.Empty:
+                continue
+            with self._capacity:
+                while not self._has_room(len(data)):
+                    if self._stopping.is_set():
+                        # Leave the message for the next subscriber
+                        self._client._messages.put((message_id, data))
+                        return
+                    self._capacity.wait(0.01)
+                self._outstanding_messages += 1
+                self._outstanding_bytes += len(data)
+
+            message = _FakeReceivedMessage(message_id, data, self._settle)
+            if self._scheduler is None:
+                self._callback(message)
+            else:
+                self._scheduler.schedule(self._callback, message)
+
+    def _settle(self, message):
+        self._client._settle(message.message_id, message.acked)
+        with self._capacity:
+            self._outstanding_messages -= 1
+            self._outstanding_bytes -= message.size
+            self._capacity.notify_all()
+
+    def cancel(self):
+        if self.done():
+            return False
+        self._stopping.set()
+        self._dispatcher.join()
+        if self._scheduler is not None:
+            self._scheduler.shutdown(await_msg_callbacks=self._await_callbacks)
+        self.set_result(None)
+        return True
+
+
+class _FakeReceivedMessage(object):
+    def __init__(self, message_id, data, settle):
+        self.message_id = message_id
+        self.data = data
+        self.size = len(data)
+        self.acked = None
+        self._settle = settle
+
+    def ack(self):
+        self._finish(True)
+
+    def nack(self):
+        self._finish(False)
+
+    def _finish(self, acked):
+        if self.acked is None:
+            self.acked = acked
+            self._settle(self)
@@ -0,0 +1,188 @@
+"""
+Flow controlled subscriber for Pub/Sub, useful in Cloud Run workers
+that need to process many messages concurrently rather than one at a time.
+
+Built on the streaming pull of the Google Cloud Pub/Sub client. The client
+library already batches acks/modacks and extends the lease of messages while
+they are being handled, so this module configures those features and adds:
+
+ - flow control (maximum outstanding messages and bytes)
+ - a thread pool of handlers of a given size
+ - graceful drain of in flight messages on shutdown
+ - per handler latency and throughput stats
+
+The handler is given the message data (bytes). If it returns without error the
+message is acked, if it raises an exception the message is nacked so it will
+be redelivered.
+
+Example use in Cloud Run:
+
+    import json
+    import gcp_pubsub_subscriber
+
+    def handle(data):
+        json_msg = json.loads(data.decode('utf-8'))
+        print(json_msg)
+
+    with gcp_pubsub_subscriber.PubSubStreamSubscriber(
+            project_id='project-id',
+            subscription_name='subscription-name',
+            handler=handle,
+            max_messages=50,
+            max_workers=10) as s:
+        s.wait(timeout=300)
+
+    print(s.stats())
+
+A local stand-in for the service can be used by passing it as the client, it
+needs to provide the subscription_path() and subscribe() methods of
+pubsub_v1.SubscriberClient, e.g., FakeSubscriberClient in
+gcp_pubsub_fakes.py. The Pub/Sub emulator is also picked up by the
+default client if the PUBSUB_EMULATOR_HOST environment variable is set.
+
+requirements.txt:
+  google-cloud-pubsub
+
+"""
+
+from concurrent import futures
+import threading
+import time
+
+from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+
+
+class HandlerStats(object):
+    """ Thread safe record of handler latency and throughput """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._stopped = None
+        self._acked = 0
+        self._nacked = 0
+        self._bytes = 0
+        self._total_time = 0.0
+        self._min_time = None
+        self._max_time = 0.0
+
+    def record(self, elapsed: float, size: int, success: bool):
+        with self._lock:
+            if success:
+                self._acked += 1
+            else:
+                self._nacked += 1
+            self._bytes += size
+            self._total_time += elapsed
+            if self._min_time is None or elapsed < self._min_time:
+                self._min_time = elapsed
+            if elapsed > self._max_time:
+                self._max_time = elapsed
+
+    def stop(self):
+        """ Fix the wall time so throughput does not decay once stopped """
+        with self._lock:
+            self._stopped = time.monotonic()
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            handled = self._acked + self._nacked
+            wall_time = (self._stopped or time.monotonic()) - self._started
+            return {
+                'handled': handled,
+                'acked': self._acked,
+                'nacked': self._nacked,
+                'bytes': self._bytes,
+                'mean_latency_s': self._total_time / handled if handled else 0.0,
+                'min_latency_s': self._min_time or 0.0,
+                'max_latency_s': self._max_time,
+                'wall_time_s': wall_time,
+                'messages_per_s': handled / wall_time if wall_time else 0.0,
+            }
+
+
+class PubSubStreamSubscriber(object):
+    def __init__(
+            self,
+            project_id: str,
+            subscription_name: str,
+            handler,
+            client: pubsub_v1.SubscriberClient=None,
+            max_messages: int=100,
+            max_bytes: int=100 * 1024 * 1024,
+            max_workers: int=10,
+            max_lease_duration: int=60 * 60
+        ):
+        self._client = client or pubsub_v1.SubscriberClient()
+        # `subscription_path` creates a fully qualified identifier in the form
+        # `projects/{project_id}/subscriptions/{subscription_name}`
+        self._subscription_path = self._client.subscription_path(
+            project_id, subscription_name
+        )
+        self._handler = handler
+
+        self._flow_control = pubsub_v1.types.FlowControl(
+            max_messages=max_messages,
+            max_bytes=max_bytes,
+            max_lease_duration=max_lease_duration,
+        )
+        self._max_workers = max_workers
+
+        self._stats = HandlerStats()
+        self._future = None  # type: pubsub_v1.subscriber.futures.StreamingPullFuture
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def start(self):
+        executor = futures.ThreadPoolExecutor(max_workers=self._max_workers)
+        self._stats = HandlerStats()
+        self._future = self._client.subscribe(
+            self._subscription_path,
+            callback=self._callback,
+            flow_control=self._flow_control,
+            scheduler=ThreadScheduler(executor),
+            await_callbacks_on_shutdown=True,
+        )
+        print(f"Listening for messages on {self._subscription_path}")
+
+    def wait(self, timeout: float=None):
+        """ Block until the stream stops, or until timeout seconds have passed """
+        if self._future is None:
+            return
+        try:
+            self._future.result(timeout=timeout)
+        except futures.TimeoutError:
+            pass
+
+    def stop(self):
+        """ Stop pulling new messages and wait for in flight handlers to finish """
+        if self._future is None:
+            return
+        self._future.cancel()
+        try:
+            self._future.result()
+        except Exception as e:
+            print(f"Error shutting down subscriber {e}")
+        self._stats.stop()
+        self._future = None
+        print(f"Stopped listening on {self._subscription_path}")
+
+    def stats(self) -> dict:
+        return self._stats.as_dict()
+
+    def _callback(self, message):
+        start = time.monotonic()
+        try:
+            self._handler(message.data)
+        except Exception as e:
+            print(f"Error handling message {message.message_id}, Error Message {e}")
+            message.nack()
+            self._stats.record(time.monotonic() - start, len(message.data), False)
+        else:
+            message.ack()
+            self._stats.record(time.monotonic() - start, len(message.data), True)
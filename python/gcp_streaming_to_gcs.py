@@ -16,7 +16,7 @@ Eample use in Cloud function:
 
 
     def hello_pubsub(event, context):
-         """Triggered from a message on a Cloud Pub/Sub topic.
+         '''Triggered from a message on a Cloud Pub/Sub topic.
          Streams example data to a file in GCS 
 
          Args:
@@ -25,7 +25,7 @@ Eample use in Cloud function:
 
          Pubsub message should be of the form of:
             {"bucketId":"bucket-id","objectId":"test-blob-namne"}
-         """
+         '''
          pubsub_message = base64.b64decode(event['data']).decode('utf-8')
          json_msg = json.loads(pubsub_message)
          try:
@@ -54,6 +54,8 @@ from google.auth.transport.requests import AuthorizedSession
 from google.resumable_media import requests, common
 from google.cloud import storage
 
+import gcp_instrumentation
+
 class GCSObjectStreamUpload(object):
     def __init__(
             self, 
@@ -70,38 +72,60 @@ class GCSObjectStreamUpload(object):
         self._buffer_size = 0
         self._chunk_size = chunk_size
         self._read = 0
+        # Bytes read by the upload that GCS has not yet confirmed, kept so that
+        # recover() can seek back to the last confirmed offset and resend them
+        self._unconfirmed = b''
 
         self._transport = AuthorizedSession(
             credentials=self._client._credentials
         )
         self._request = None  # type: requests.ResumableUpload
+        self._record = None  # type: gcp_instrumentation.CallRecord
 
     def __enter__(self):
         self.start()
         return self
 
-    def __exit__(self, exc_type, *_):
+    def __exit__(self, exc_type, exc_value, *_):
         if exc_type is None:
             self.stop()
+        else:
+            gcp_instrumentation.finish(self._record, exc_value)
+            self._record = None
 
     def start(self):
+        self._record = gcp_instrumentation.begin('GCSObjectStreamUpload', count_retries=True)
+        # Use the client's endpoint so STORAGE_EMULATOR_HOST/local servers are respected
         url = (
-            f'https://www.googleapis.com/upload/storage/v1/b/'
+            f'{self._client.api_endpoint}/upload/storage/v1/b/'
             f'{self._bucket.name}/o?uploadType=resumable'
         )
         self._request = requests.ResumableUpload(
             upload_url=url, chunk_size=self._chunk_size
         )
-        self._request.initiate(
-            transport=self._transport,
-            content_type='application/octet-stream',
-            stream=self,
-            stream_final=False,
-            metadata={'name': self._blob.name},
-        )
+        try:
+            self._request.initiate(
+                transport=self._transport,
+                content_type='application/octet-stream',
+                stream=self,
+                stream_final=False,
+                metadata={'name': self._blob.name},
+            )
+        except Exception as e:
+            # __exit__ is not called if start() fails, so record the failure here
+            gcp_instrumentation.finish(self._record, e)
+            self._record = None
+            raise
 
     def stop(self):
-        self._request.transmit_next_chunk(self._transport)
+        try:
+            self._request.transmit_next_chunk(self._transport)
+        except Exception as e:
+            gcp_instrumentation.finish(self._record, e)
+            self._record = None
+            raise
+        gcp_instrumentation.finish(self._record)
+        self._record = None
 
     def write(self, data: bytes) -> int:
         data_len = len(data)
@@ -112,7 +136,9 @@ class GCSObjectStreamUpload(object):
             try:
                 self._request.transmit_next_chunk(self._transport)
             except common.InvalidResponse:
+                gcp_instrumentation.record_retry(self._record)
                 self._request.recover(self._transport)
+            self._confirm()
         return data_len
 
     def read(self, chunk_size: int) -> bytes:
@@ -123,7 +149,29 @@ class GCSObjectStreamUpload(object):
         self._buffer = memview[to_read:].tobytes()
         self._read += to_read
         self._buffer_size -= to_read
-        return memview[:to_read].tobytes()
+        gcp_instrumentation.record_bytes(to_read, self._record)
+        chunk = memview[:to_read].tobytes()
+        self._unconfirmed += chunk
+        return chunk
 
     def tell(self) -> int:
         return self._read
+
+    def seek(self, offset: int, whence: int=0) -> int:
+        # recover() seeks back to the offset GCS has confirmed, so the
+        # unconfirmed bytes are put back in front of the buffer to be resent
+        confirmed = self._read - len(self._unconfirmed)
+        if whence != 0 or not confirmed <= offset <= self._read:
+            raise ValueError(f'Can only seek to an offset between {confirmed} and {self._read}')
+        rewind = self._read - offset
+        if rewind:
+            self._buffer = self._unconfirmed[-rewind:] + self._buffer
+            self._unconfirmed = self._unconfirmed[:-rewind]
+            self._buffer_size += rewind
+            self._read = offset
+        return offset
+
+    def _confirm(self):
+        # Drop the bytes GCS has confirmed it received, they are never resent
+        confirmed = self._read - len(self._unconfirmed)
+        self._unconfirmed = self._unconfirmed[self._request.bytes_uploaded - confirmed:]
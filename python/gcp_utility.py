@@ -19,6 +19,9 @@ Interacts with a number of Cloud Native Functions, including:
  - delete a collection in FireStore
  - update a document in a Collection in FireStore
 
+Each call to a helper that talks to GCP is recorded by gcp_instrumentation
+(wall time, bytes, outcome) when a sink is registered.
+
 """
 
 from google.cloud import storage
@@ -28,6 +31,8 @@ from google.cloud import firestore
 import json
 import time
 
+from gcp_instrumentation import instrumented, record_bytes, record_error
+
 
 #############################################################################
 ######## GCS Functions
@@ -45,6 +50,7 @@ def extract_from_uri(uri):
     return parts[0], parts[1]
 
 
+@instrumented()
 def get_file_blob_from_gcs(bucket_name, blob_name):
     """ Gets a blob from a file in a given bucket
     Once the blob is obtained you can download as appropriate, e.g.,
@@ -77,10 +83,12 @@ def get_file_blob_from_gcs(bucket_name, blob_name):
         blob = bucket.blob(blob_name)
         return blob
     except Exception as e:
+        record_error(e)
         print("Error getting file {}/{}, Error Message {}".format(bucket_name, blob_name, e))
         return None
 
 
+@instrumented()
 def get_json_blob_from_gcs(bucket_name, blob_name):
     """ Gets a JSON file from Google Cloud Storage Bucket
     Args:
@@ -94,7 +102,9 @@ def get_json_blob_from_gcs(bucket_name, blob_name):
         print("Could not access JSON file, check it is uploaded and you have permission")
         return None    
     # Download the contents of the blob as bytes and then parse it using json.loads() method
-    json_file = json.loads(blob.download_as_bytes(client=None))
+    contents = blob.download_as_bytes(client=None)
+    record_bytes(len(contents))
+    json_file = json.loads(contents)
     if json_file is None:
         print("Could not read JSON file, check it is in the correct format")
         return None
@@ -103,6 +113,7 @@ def get_json_blob_from_gcs(bucket_name, blob_name):
         return json_file
 
 
+@instrumented()
 def upload_to_gcs_bucket(bucket_name, destination_blob_name, text, content_type='text/csv'):
     """Uploads the given text to GC Storage as a given file type
 
@@ -123,6 +134,7 @@ def upload_to_gcs_bucket(bucket_name, destination_blob_name, text, content_type=
         bucket = storage_client.bucket(bucket_name)
         #bucket = storage_client.get_bucket(bucket_name)
     except Exception as e:
+        record_error(e)
         print("Could not get bucket {}".format(bucket_name))
         print(e)    
         
@@ -131,15 +143,19 @@ def upload_to_gcs_bucket(bucket_name, destination_blob_name, text, content_type=
         # upload to bucket
         try:
             blob.upload_from_string(text, content_type=content_type)
+            # Count bytes, not characters, of text sent as utf-8
+            record_bytes(len(text.encode('utf-8')) if isinstance(text, str) else len(text))
             uri = 'gs://' + bucket_name + '/' + destination_blob_name
             
             print('File {} uploaded to {}'.format(destination_blob_name, bucket_name))
             return uri
         except Exception as e:
+            record_error(e)
             print('Error uploading {} to bucket {}'.format(destination_blob_name, bucket_name))
             print(e)
             return None    
 
+@instrumented()
 def delete_gcs_object(bucket_name, blob_name):
     """Deletes a object blob from the bucket."""
     storage_client = storage.Client()
@@ -151,6 +167,7 @@ def delete_gcs_object(bucket_name, blob_name):
     print(f"Blob {bucket_name}/{object_name} deleted.")
 
 
+@instrumented()
 def copy_gcs_object(bucket_name, object_name, destination_bucket_name, destination_object_name):
     """Copies an object blob from a bucket to another bucket location"""
     storage_client = storage.Client()
@@ -170,6 +187,7 @@ def copy_gcs_object(bucket_name, object_name, destination_bucket_name, destinati
 #############################################################################
 ######## Pub/Sub Functions
 
+@instrumented()
 def message_to_pubsub(topic_name, message, project_id):
     """
     Published a message to the Pub/Sub topic in project
@@ -198,14 +216,18 @@ def message_to_pubsub(topic_name, message, project_id):
         data = message.encode('utf-8')
         # When you publish a message, the client returns a future.
         future = publisher.publish(topic_path, data=data)
-        print('Published {} of message ID {}.'.format(data, future.result()))
+        message_id = future.result()
+        record_bytes(len(data))
+        print('Published {} of message ID {}.'.format(data, message_id))
     except Exception as e:
+        record_error(e)
         print(f"Error with PubSub {e}")
 
       
 #############################################################################
 ######## BigQuery Functions
 
+@instrumented()
 def read_data_from_bigquery_to_df(sql):
     """
     Gets data from BigQuery and saves to Pandas DataFrame 
@@ -220,12 +242,14 @@ def read_data_from_bigquery_to_df(sql):
         df = client.query(sql).to_dataframe()
         return df
     except Exception as e:
+        record_error(e)
         print(f"Error getting data {e}")
         return None 
  
 
+@instrumented()
 def ingest_dataframe_to_bigquery(project_id, dataset_id, table_id, write_type, schema, skip_rows):
-    """
+    """ Save the league table to Big Query
        [
           bigquery.SchemaField("column1", bigquery.enums.SqlTypeNames.DATE),
           bigquery.SchemaField("column2", bigquery.enums.SqlTypeNames.STRING),
@@ -234,7 +258,6 @@ def ingest_dataframe_to_bigquery(project_id, dataset_id, table_id, write_type, s
         ]
     
     """
-""" Save the league table to Big Query"""
     client = bigquery.Client()
     table_id = 'ons-hotspot-prod.processing.incidence_league_tables'
     job_config = bigquery.LoadJobConfig(
@@ -251,6 +274,7 @@ def ingest_dataframe_to_bigquery(project_id, dataset_id, table_id, write_type, s
     )  # Make an API request.
     job.result()  # Wait for the job to complete.
 
+@instrumented()
 def save_league_table_date(df,dataset_id, table_id, write_type, schema):
     """ Save dataframe to BigQuery Table
   
@@ -276,7 +300,7 @@ def save_league_table_date(df,dataset_id, table_id, write_type, schema):
             bigquery.SchemaField("Col4", bigquery.enums.SqlTypeNames.FLOAT),
     """
     client = bigquery.Client()
-    table_id = f"{project_id}.{dataset_id}.{table_id}'
+    table_id = f"{project_id}.{dataset_id}.{table_id}"
     job_config = bigquery.LoadJobConfig(schema=schema)
     
     # Set the update type
@@ -298,6 +322,7 @@ def save_league_table_date(df,dataset_id, table_id, write_type, schema):
         )
     )
 
+@instrumented()
 def ingest_csv_to_bigquery(uri, dataset_id, table_id, write_type, schema, skip_rows):
     """
     Ingests a csv file at location uri into BigQuery
@@ -347,10 +372,12 @@ def ingest_csv_to_bigquery(uri, dataset_id, table_id, write_type, schema, skip_r
         print(f"Loaded {destination_table.num_rows} rows from {uri}.")
         return destination_table
     except Exception as e:
+        record_error(e)
         print(f"Error ingesting data into BigQuery {e}")
         return None
 
 
+@instrumented()
 def run_scheduled_query(resource_name):
     """ Runs a scheduled query in BigQuery
     An example resource_name string would be 
@@ -372,12 +399,14 @@ def run_scheduled_query(resource_name):
         print("Scheduled Query instigated")
         return True
     except Exception as e:
+        record_error(e)
         print(f"Error running schedule query {e}")
         return False
 
 #############################################################################
 ######## Firestore Functions
 
+@instrumented()
 def delete_collection(collection_name, batch_size=200):
     """ Delete a given collection in FireStore
     
@@ -389,19 +418,23 @@ def delete_collection(collection_name, batch_size=200):
     try:
         db = firestore.Client()
         coll_ref = db.collection(collection_name)
-        docs = coll_ref.limit(batch_size).stream()
-        # Keep a record of how many docs are deletec
-        deleted = 0
-        for doc in docs:
-            doc.reference.delete()
-            deleted = deleted + 1
-        print(f"Deleted {deleted} docs")
-        if deleted >= batch_size:
-            return delete_collection(collection_name, batch_size)
+        # Delete in batches until a batch comes back short. A loop rather than
+        # recursion so the whole delete is recorded as a single helper call
+        deleted = batch_size
+        while deleted >= batch_size:
+            docs = coll_ref.limit(batch_size).stream()
+            # Keep a record of how many docs are deletec
+            deleted = 0
+            for doc in docs:
+                doc.reference.delete()
+                deleted = deleted + 1
+            print(f"Deleted {deleted} docs")
     except Exception as e:
+        record_error(e)
         print(f"Error Deleting Collection docs {e}")
       
 
+@instrumented()
 def update_firestore_document(collection, document, values_dict):
     """ Updates a document in a collection in FireStore
     
@@ -423,9 +456,11 @@ def update_firestore_document(collection, document, values_dict):
         doc_ref.set(values_dict)
         return
     except Exception as e:
+        record_error(e)
         print(f"Error updating State {e}")
         return
 
+@instrumented()
 def check_firestore_values(collection, query):
     """ Query the documents in a given collection
     
@@ -452,5 +487,6 @@ def check_firestore_values(collection, query):
             results = coll_ref.stream()
         return results
     except Exception as e:
+        record_error(e)
         print(f"Error getting State {e}")
         return False
@@ -0,0 +1,160 @@
+import io
+import json
+
+import pytest
+
+import gcp_instrumentation
+
+
+class ListSink(object):
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class FailingSink(object):
+    def emit(self, record):
+        raise RuntimeError('sink failed')
+
+
+@pytest.fixture(autouse=True)
+def clear_sinks():
+    gcp_instrumentation.clear_sinks()
+    yield
+    gcp_instrumentation.clear_sinks()
+
+
+@gcp_instrumentation.instrumented()
+def transfer(n):
+    gcp_instrumentation.record_bytes(n)
+    return n
+
+
+@gcp_instrumentation.instrumented()
+def swallowed_error():
+    try:
+        raise ValueError('bad value')
+    except Exception as e:
+        gcp_instrumentation.record_error(e)
+        return None
+
+
+@gcp_instrumentation.instrumented('renamed')
+def raises():
+    raise KeyError('missing')
+
+
+def test_disabled_passes_through():
+    assert not gcp_instrumentation.enabled()
+    assert gcp_instrumentation.begin('helper') is None
+    assert transfer(3) == 3
+    # Recording outside a call is a no-op
+    gcp_instrumentation.record_bytes(3)
+    gcp_instrumentation.record_retry()
+
+
+def test_records_call():
+    sink = ListSink()
+    gcp_instrumentation.add_sink(sink)
+
+    assert transfer(5) == 5
+
+    [record] = sink.records
+    assert record.name == 'transfer'
+    assert record.bytes == 5
+    assert record.outcome == 'ok'
+    assert record.wall_time_s >= 0
+    assert 'retries' not in record.as_dict()
+
+
+def test_record_error_on_swallowed_exception():
+    sink = ListSink()
+    gcp_instrumentation.add_sink(sink)
+
+    assert swallowed_error() is None
+
+    [record] = sink.records
+    assert record.outcome == 'error'
+    assert record.error_type == 'ValueError'
+    assert record.error_message == 'bad value'
+
+
+def test_raised_exception_recorded_and_propagated():
+    sink = ListSink()
+    gcp_instrumentation.add_sink(sink)
+
+    with pytest.raises(KeyError):
+        raises()
+
+    [record] = sink.records
+    assert record.name == 'renamed'
+    assert record.error_type == 'KeyError'
+
+
+def test_sink_failure_isolated():
+    sink = ListSink()
+    gcp_instrumentation.add_sink(FailingSink())
+    gcp_instrumentation.add_sink(sink)
+
+    assert transfer(1) == 1
+    assert len(sink.records) == 1
+
+
+def test_count_retries():
+    sink = ListSink()
+    gcp_instrumentation.add_sink(sink)
+
+    record = gcp_instrumentation.begin('stream', count_retries=True)
+    gcp_instrumentation.record_retry(record)
+    gcp_instrumentation.record_retry(record)
+    gcp_instrumentation.finish(record)
+
+    assert sink.records[0].as_dict()['retries'] == 2
+
+
+def test_histogram_bucketing():
+    sink = gcp_instrumentation.HistogramSink(bounds=(0.1, 1.0))
+    for wall_time in (0.05, 0.1, 0.5, 2.0, 3.0):
+        record = gcp_instrumentation.CallRecord('helper')
+        record.wall_time_s = wall_time
+        record.bytes = 10
+        sink.emit(record)
+
+    hist = sink.snapshot()['helper']
+    # Upper bounds are inclusive, the last bucket counts everything above
+    assert hist['counts'] == [2, 1, 2]
+    assert hist['calls'] == 5
+    assert hist['bytes'] == 50
+    assert hist['bounds'] == [0.1, 1.0]
+    assert 'retries' not in hist
+
+    sink.reset()
+    assert sink.snapshot() == {}
+
+
+def test_json_log_sink():
+    stream = io.StringIO()
+    gcp_instrumentation.add_sink(gcp_instrumentation.JsonLogSink(stream))
+
+    swallowed_error()
+
+    entry = json.loads(stream.getvalue())
+    assert entry['helper'] == 'swallowed_error'
+    assert entry['severity'] == 'ERROR'
+    assert entry['error_type'] == 'ValueError'
+
+
+def test_invocation_stats_without_sinks():
+    with gcp_instrumentation.invocation_stats() as stats:
+        transfer(2)
+        transfer(3)
+        swallowed_error()
+
+    helpers = stats.as_dict()['helpers']
+    assert helpers['transfer']['calls'] == 2
+    assert helpers['transfer']['bytes'] == 5
+    assert helpers['swallowed_error']['errors'] == 1
+    # Outside the block calls are no longer recorded
+    assert not gcp_instrumentation.enabled()
@@ -0,0 +1,167 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('google.cloud.pubsub_v1')
+
+import gcp_pubsub_subscriber
+from gcp_pubsub_fakes import FakeSubscriberClient
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out waiting for condition')
+        time.sleep(0.01)
+
+
+def make_subscriber(client, handler, **kwargs):
+    return gcp_pubsub_subscriber.PubSubStreamSubscriber(
+        project_id='project-id',
+        subscription_name='subscription-name',
+        handler=handler,
+        client=client,
+        **kwargs
+    )
+
+
+def test_acks_on_success():
+    client = FakeSubscriberClient()
+    message_ids = [client.add_message(b'data') for _ in range(5)]
+    received = []
+
+    with make_subscriber(client, received.append):
+        wait_for(lambda: len(client.acked) == 5)
+
+    assert sorted(client.acked) == sorted(message_ids)
+    assert client.nacked == []
+    assert received == [b'data'] * 5
+
+
+def test_nacks_on_handler_exception():
+    client = FakeSubscriberClient()
+    good = client.add_message(b'good')
+    bad = client.add_message(b'bad')
+
+    def handler(data):
+        if data == b'bad':
+            raise ValueError('bad message')
+
+    with make_subscriber(client, handler):
+        wait_for(lambda: len(client.acked) + len(client.nacked) == 2)
+
+    assert client.acked == [good]
+    assert client.nacked == [bad]
+
+
+def test_stats_counts():
+    client = FakeSubscriberClient()
+    for data in (b'a', b'bb', b'error'):
+        client.add_message(data)
+
+    def handler(data):
+        if data == b'error':
+            raise ValueError('error')
+
+    with make_subscriber(client, handler) as s:
+        wait_for(lambda: s.stats()['handled'] == 3)
+
+    stats = s.stats()
+    assert stats['acked'] == 2
+    assert stats['nacked'] == 1
+    assert stats['bytes'] == 8
+    assert stats['max_latency_s'] >= stats['min_latency_s']
+
+
+def test_stats_wall_time_fixed_after_stop():
+    client = FakeSubscriberClient()
+    client.add_message(b'data')
+
+    with make_subscriber(client, lambda data: None) as s:
+        wait_for(lambda: s.stats()['handled'] == 1)
+
+    wall_time = s.stats()['wall_time_s']
+    time.sleep(0.05)
+    assert s.stats()['wall_time_s'] == wall_time
+
+
+def test_stop_drains_in_flight_messages():
+    client = FakeSubscriberClient()
+    message_id = client.add_message(b'slow')
+    started = threading.Event()
+
+    def handler(data):
+        started.set()
+        time.sleep(0.2)
+
+    s = make_subscriber(client, handler)
+    s.start()
+    assert started.wait(5)
+    s.stop()
+
+    assert client.acked == [message_id]
+    assert s.stats()['acked'] == 1
+
+
+def test_flow_control_limits_outstanding_messages():
+    client = FakeSubscriberClient()
+    for _ in range(10):
+        client.add_message(b'data')
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def handler(data):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    with make_subscriber(client, handler, max_messages=2, max_workers=5):
+        wait_for(lambda: len(client.acked) == 10)
+
+    assert peak[0] <= 2
+
+
+def test_flow_control_limits_outstanding_bytes():
+    client = FakeSubscriberClient()
+    for _ in range(6):
+        client.add_message(b'x' * 40)
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def handler(data):
+        with lock:
+            running[0] += len(data)
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= len(data)
+
+    with make_subscriber(client, handler, max_messages=10, max_bytes=100, max_workers=5):
+        wait_for(lambda: len(client.acked) == 6)
+
+    assert peak[0] <= 100
+
+
+def test_flow_control_passed_to_subscribe():
+    client = FakeSubscriberClient()
+
+    with make_subscriber(client, lambda data: None,
+                         max_messages=7, max_bytes=1024, max_lease_duration=600):
+        pass
+
+    assert client.flow_control.max_messages == 7
+    assert client.flow_control.max_bytes == 1024
+    assert client.flow_control.max_lease_duration == 600
+
+
+def test_wait_before_start_returns():
+    s = make_subscriber(FakeSubscriberClient(), lambda data: None)
+    s.wait(timeout=0.01)
+    s.stop()
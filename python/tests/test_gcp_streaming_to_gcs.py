@@ -0,0 +1,148 @@
+import types
+
+import pytest
+
+pytest.importorskip('google.resumable_media')
+
+from google.resumable_media import common
+
+import gcp_instrumentation
+import gcp_streaming_to_gcs
+
+CHUNK_SIZE = 16
+
+
+class ListSink(object):
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class FakeResumableUpload(object):
+    """ Behaves like requests.ResumableUpload with stream_final=False: each
+    transmit reads a chunk from the stream and a short chunk ends the upload.
+    Failures can be injected on a given transmit.
+    """
+    instances = []
+
+    def __init__(self, upload_url, chunk_size):
+        self.upload_url = upload_url
+        self.chunk_size = chunk_size
+        self.bytes_uploaded = 0
+        self.received = b''
+        self.finished = False
+        self.transmits = 0
+        # transmit number -> exception to raise instead of storing the chunk
+        self.failures = {}
+        self.initiate_error = None
+        self.instances.append(self)
+
+    def initiate(self, transport, content_type, stream, stream_final, metadata):
+        if self.initiate_error is not None:
+            raise self.initiate_error
+        self._stream = stream
+
+    def transmit_next_chunk(self, transport):
+        self.transmits += 1
+        assert self._stream.tell() == self.bytes_uploaded
+        data = self._stream.read(self.chunk_size)
+        error = self.failures.pop(self.transmits, None)
+        if error is not None:
+            raise error
+        self.received += data
+        self.bytes_uploaded += len(data)
+        self.finished = len(data) < self.chunk_size
+
+    def recover(self, transport):
+        # GCS reports the bytes it has, and the stream is rewound to them
+        self._stream.seek(self.bytes_uploaded)
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    FakeResumableUpload.instances = []
+    monkeypatch.setattr(gcp_streaming_to_gcs.requests, 'ResumableUpload', FakeResumableUpload)
+    monkeypatch.setattr(gcp_streaming_to_gcs, 'AuthorizedSession', lambda credentials: None)
+    sink = ListSink()
+    gcp_instrumentation.clear_sinks()
+    gcp_instrumentation.add_sink(sink)
+    yield sink
+    gcp_instrumentation.clear_sinks()
+
+
+def make_upload():
+    bucket = types.SimpleNamespace(name='bucket', blob=lambda name: types.SimpleNamespace(name=name))
+    client = types.SimpleNamespace(
+        api_endpoint='http://localhost:9023',
+        _credentials=None,
+        bucket=lambda name: bucket,
+    )
+    return gcp_streaming_to_gcs.GCSObjectStreamUpload(
+        client=client, bucket_name='bucket', blob_name='blob', chunk_size=CHUNK_SIZE
+    )
+
+
+def test_upload_url_uses_client_endpoint(sink):
+    with make_upload() as s:
+        s.write(b'data')
+
+    upload = FakeResumableUpload.instances[0]
+    assert upload.upload_url == (
+        'http://localhost:9023/upload/storage/v1/b/bucket/o?uploadType=resumable'
+    )
+    assert upload.received == b'data'
+    assert sink.records[0].as_dict()['retries'] == 0
+
+
+def test_recover_resends_unconfirmed_bytes(sink):
+    data = bytes(range(100))
+    s = make_upload()
+    s.start()
+    upload = FakeResumableUpload.instances[0]
+    upload.failures[2] = common.InvalidResponse(None, 'upload failed')
+    for i in range(0, len(data), 10):
+        s.write(data[i:i + 10])
+    s.stop()
+
+    assert upload.received == data
+    assert upload.finished
+    [record] = sink.records
+    assert record.outcome == 'ok'
+    assert record.retries == 1
+
+
+def test_seek_outside_unconfirmed_bytes(sink):
+    with make_upload() as s:
+        s.write(b'x' * CHUNK_SIZE * 2)
+        with pytest.raises(ValueError):
+            s.seek(0)
+
+
+def test_failed_final_chunk_recorded(sink):
+    with pytest.raises(ConnectionError):
+        with make_upload() as s:
+            FakeResumableUpload.instances[0].failures[1] = ConnectionError('connection reset')
+            s.write(b'short')
+
+    [record] = sink.records
+    assert record.outcome == 'error'
+    assert record.error_type == 'ConnectionError'
+
+
+def test_failed_start_recorded(sink, monkeypatch):
+    class FailingUpload(FakeResumableUpload):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.initiate_error = ConnectionError('no route to host')
+
+    monkeypatch.setattr(gcp_streaming_to_gcs.requests, 'ResumableUpload', FailingUpload)
+
+    with pytest.raises(ConnectionError):
+        with make_upload():
+            pass
+
+    [record] = sink.records
+    assert record.outcome == 'error'
+    assert record.error_type == 'ConnectionError'